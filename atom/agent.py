@@ -1,12 +1,16 @@
+import asyncio
 import os
+import time
 from dataclasses import dataclass
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from pydantic_ai import Agent, RunContext
 from pydantic_ai.models.openai import OpenAIModel
 
+from atom.retry import openai_retry
 from supabase import Client
 
 load_dotenv()
@@ -41,17 +45,85 @@ library_agent = Agent(
 )
 
 
+CHUNK_SEPARATOR = "\n\n---\n\n"
+
+_EMBEDDING_CACHE_SIZE = 256
+_embedding_cache: Dict[str, List[float]] = {}
+
+
+@openai_retry
 async def get_embedding(text: str, openai_client: AsyncOpenAI) -> List[float]:
+    if text in _embedding_cache:
+        return _embedding_cache[text]
+
+    response = await openai_client.embeddings.create(
+        model="text-embedding-3-small", input=text
+    )
+    embedding = response.data[0].embedding
+    if len(_embedding_cache) >= _EMBEDDING_CACHE_SIZE:
+        # Drop the oldest entry, dicts keep insertion order
+        del _embedding_cache[next(iter(_embedding_cache))]
+    _embedding_cache[text] = embedding
+    return embedding
+
+
+SEMANTIC_CACHE_MAX_DISTANCE = 0.08
+SEMANTIC_CACHE_TTL = timedelta(hours=1)
+
+
+async def get_cached_response(
+    supabase: Client, query_embedding: List[float]
+) -> Optional[str]:
+    """
+    Look up a stored response for a semantically similar question.
+    See supabase/migrations/20261015000200_semantic_cache.sql.
+    """
+    if not query_embedding:
+        return None
     try:
-        response = await openai_client.embeddings.create(
-            model="text-embedding-3-small", input=text
+        result = await asyncio.to_thread(
+            supabase.rpc(
+                "match_semantic_cache",
+                {
+                    "query_embedding": query_embedding,
+                    "max_distance": SEMANTIC_CACHE_MAX_DISTANCE,
+                    "max_age": f"{SEMANTIC_CACHE_TTL.total_seconds()} seconds",
+                },
+            ).execute
         )
-        return response.data[0].embedding
+        return result.data[0]["response"] if result.data else None
     except Exception as e:
-        print(f"Failed to get embeddings: {e}")
-        return [] * 1536
+        print(f"Failed to query semantic cache: {e}")
+        return None
 
 
+async def cache_response(
+    supabase: Client, query_embedding: Optional[List[float]], response: str
+):
+    if not query_embedding or not response:
+        return
+    try:
+        await asyncio.to_thread(
+            supabase.table("semantic_cache")
+            .insert({"query_embedding": query_embedding, "response": response})
+            .execute
+        )
+        # Expired rows are never served but would crowd out live ones in the HNSW scan
+        expired_before = datetime.now(timezone.utc) - SEMANTIC_CACHE_TTL
+        await asyncio.to_thread(
+            supabase.table("semantic_cache")
+            .delete()
+            .lt("created_at", expired_before.isoformat())
+            .execute
+        )
+    except Exception as e:
+        print(f"Failed to store response in semantic cache: {e}")
+
+
+# match_code_pages and its HNSW index are defined in
+# supabase/migrations/20261015000100_match_code_pages_hnsw.sql and
+# switched to halfvec embeddings in 20261015000400_code_pages_halfvec.sql.
+# Without the index every query is a sequential scan over code_pages.
 @library_agent.tool
 async def get_code(ctx: RunContext[Dependencies], user_query: str) -> str:
     """
@@ -66,36 +138,36 @@ async def get_code(ctx: RunContext[Dependencies], user_query: str) -> str:
     """
     try:
         print(f"Fetching: {user_query}")
-        query_embedding = get_embedding(user_query, ctx.deps.openai_client)
-
-        result = ctx.deps.supabase.rpc(
-            "match_code_pages",
-            {
-                "query_embedding": query_embedding,
-                "match_count": 5,
-                "filter": {"source": "swiftui-atom-properties"},
-            },
-        ).execute()
+        query_embedding = await get_embedding(user_query, ctx.deps.openai_client)
+
+        result = await asyncio.to_thread(
+            ctx.deps.supabase.rpc(
+                "match_code_pages",
+                {
+                    "query_embedding": query_embedding,
+                    "match_count": 5,
+                    "filter": {"source": "swiftui-atom-properties"},
+                },
+            ).execute
+        )
 
-        if not result:
+        if not result.data:
             return "No relevant source code found"
 
-        formatted_chunks = []
-        for source_code in result:
-            chunk_text = """
-            {source_code['type_name']}
-
-            {source_code['content']}
-            """
-            formatted_chunks.append(chunk_text)
-
-        return "\n\n---\n\n".join(formatted_chunks)
+        return CHUNK_SEPARATOR.join(
+            f"{source_code['type_name']}\n\n{source_code['content']}"
+            for source_code in result.data
+        )
 
     except Exception as e:
         print(f"Failed to fetch Source code: {e}")
         return f"Error retrieving Source code: {str(e)}"
 
 
+TYPE_CACHE_TTL = 300
+_type_cache: Optional[Tuple[float, List[str]]] = None
+
+
 @library_agent.tool
 async def get_type_names(ctx: RunContext[Dependencies]) -> List[str]:
     """
@@ -104,19 +176,24 @@ async def get_type_names(ctx: RunContext[Dependencies]) -> List[str]:
     Returns:
         List[str]: A list of Swift Type names
     """
+    global _type_cache
+    if _type_cache and time.monotonic() - _type_cache[0] < TYPE_CACHE_TTL:
+        return _type_cache[1]
+
     try:
         print(f"Fetching Types")
-        result = (
-            ctx.deps.supabase.from_("code_pages")
-            .select("type_name")
-            .eq("metadata->>source", "swiftui-atom-properties")
-            .execute()
+        result = await asyncio.to_thread(
+            ctx.deps.supabase.rpc(
+                "list_type_names", {"source": "swiftui-atom-properties"}
+            ).execute
         )
 
-        if not result:
+        if not result.data:
             return []
 
-        names = sorted(set(file["type_name"] for file in result.data))
+        names = [row["type_name"] for row in result.data]
+        # Only cache non-empty lists so types show up as soon as they're ingested
+        _type_cache = (time.monotonic(), names)
         return names
     except Exception as e:
         print(f"Failed to retieve source code pages: {e}")
@@ -137,13 +214,13 @@ async def get_code_for_type(ctx: RunContext[Dependencies], type_name: str) -> st
     """
     try:
         print(f"Fetching Source Code for: {type_name}")
-        result = (
+        result = await asyncio.to_thread(
             ctx.deps.supabase.from_("code_pages")
             .select("content, metadata->>file_path, chunk_idx")
             .eq("type_name", type_name)
-            .eq("metadata->>source", "swiftui-atom-properties")
+            .eq("source_tag", "swiftui-atom-properties")
             .order("chunk_idx")
-            .execute()
+            .execute
         )
 
         if not result:
@@ -1,3 +1,6 @@
+-- Original schema, kept for reference. Set up the database from supabase/migrations,
+-- which start from this file and add everything the agent and ingest code need.
+
 -- Enable the pgvector extension
 create extension if not exists vector;
 
@@ -1,22 +1,46 @@
 import asyncio
+import hashlib
 import os
+import pickle
+import random
+import re
+import sqlite3
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Tuple, cast
+from typing import Dict, Iterator, List, Optional, Tuple, cast
 
-from crawl4ai import RegexChunking
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 
+from atom.retry import RETRYABLE_ERRORS, openai_retry
 from supabase import Client, create_client
 
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 supabase_client: Client = create_client(
     supabase_url=cast(str, os.getenv("SUPABASE_URL")),
     supabase_key=cast(str, os.getenv("SUPABASE_SERVICE_KEY")),
 )
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_PATH = Path(".embed_cache/embeddings.db")
+
+# Limits on the chunks sent per embeddings request
+EMBEDDING_BATCH_SIZE = 96
+MAX_BATCH_TOKENS = 7000
+# Number of workers embedding, summarizing and inserting batches concurrently
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+# Characters read from the markdown file at a time
+READ_BLOCK_SIZE = 64 * 1024
+CHUNK_BOUNDARY = re.compile(r"(?:````|```)\n\n")
+# "## <file path>" heading, two lines of fence/spacing, then the file contents
+CHUNK_HEADER = re.compile(
+    r"[# ]*(?P<path>[^\n]*)\n[^\n]*\n[^\n]*\n(?P<content>.*)", re.DOTALL
+)
+
+# Caps in-flight summary requests to stay under the OpenAI rate limits
+summary_semaphore = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "8")))
+
 
 @dataclass
 class ProcessedChunk:
@@ -28,11 +52,13 @@ class ProcessedChunk:
     metadata: Dict[str, str]
 
 
+@openai_retry
 async def get_summary(content: str) -> str:
     developer_prompt = """You are an expert at summarizing content from Swift type documentation and code examples:
     Return the concise summary.
     """
-    try:
+    async with summary_semaphore:
+        await asyncio.sleep(random.uniform(0, 0.1))
         response = await openai_client.chat.completions.create(
             model=os.getenv("MODEL", "gpt-4o-mini"),
             messages=[
@@ -40,30 +66,179 @@ async def get_summary(content: str) -> str:
                 {"role": "user", "content": content},
             ],
         )
-        if response and response.choices:
-            return response.choices[0].message.content.strip()
-        else:
-            print(f"No response when trying to summarize content")
-            return ""
+    if response and response.choices:
+        return response.choices[0].message.content.strip()
+    else:
+        print(f"No response when trying to summarize content")
+        return ""
+
+
+_embedding_cache: Optional[sqlite3.Connection] = None
+
+
+def get_embedding_cache() -> sqlite3.Connection:
+    """Open the on-disk embedding cache, creating it on first use."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        EMBEDDING_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _embedding_cache = sqlite3.connect(EMBEDDING_CACHE_PATH)
+        _embedding_cache.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB)"
+        )
+    return _embedding_cache
+
+
+def embedding_cache_key(content: str) -> str:
+    # The model is part of the key so switching models invalidates old entries
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\0{content}".encode("utf-8")).hexdigest()
+
+
+def load_cached_embeddings(keys: List[str]) -> Dict[str, List[float]]:
+    cache = get_embedding_cache()
+    cached = {}
+    # Stay under SQLite's bound parameter limit
+    for i in range(0, len(keys), 500):
+        batch = keys[i : i + 500]
+        placeholders = ",".join("?" * len(batch))
+        rows = cache.execute(
+            f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})",
+            batch,
+        )
+        cached.update({key: pickle.loads(blob) for key, blob in rows})
+    return cached
+
+
+def store_cached_embeddings(entries: Dict[str, List[float]]):
+    cache = get_embedding_cache()
+    with cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+            [(key, pickle.dumps(embedding)) for key, embedding in entries.items()],
+        )
+
+
+@openai_retry
+async def get_embeddings_batch(contents: List[str]) -> List[List[float]]:
+    response = await openai_client.embeddings.create(
+        model=EMBEDDING_MODEL, input=contents
+    )
+    return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+
+def estimate_tokens(content: str) -> int:
+    return len(content) // 4
+
+
+def pack_embedding_batches(
+    keys: List[str], contents: Dict[str, str]
+) -> List[List[str]]:
+    """
+    Group keys into embedding requests of similar length contents.
+    Each batch holds at most EMBEDDING_BATCH_SIZE inputs and MAX_BATCH_TOKENS estimated tokens,
+    a single oversized content gets a batch of its own.
+    """
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    batch_tokens = 0
+    for key in sorted(keys, key=lambda key: estimate_tokens(contents[key])):
+        tokens = estimate_tokens(contents[key])
+        if batch and (
+            len(batch) == EMBEDDING_BATCH_SIZE
+            or batch_tokens + tokens > MAX_BATCH_TOKENS
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(key)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# Futures for embeddings currently being requested, shared across get_embeddings calls
+_pending_embeddings: Dict[str, "asyncio.Future[Optional[List[float]]]"] = {}
+
+
+async def embed_batch(
+    keys: List[str], contents: Dict[str, str]
+) -> Dict[str, List[float]]:
+    """
+    Embed one packed batch.
+    If the request is rejected it's split in half and retried, so only the inputs that fail on their own are left out.
+    """
+    try:
+        embeddings = await get_embeddings_batch([contents[key] for key in keys])
+        return dict(zip(keys, embeddings))
     except Exception as e:
-        print(f"Failed to get content summary: {e}")
-        return f"Error summarizing content"
+        # Transient errors already used up their retries, splitting won't help
+        if len(keys) == 1 or isinstance(e, RETRYABLE_ERRORS):
+            print(f"Failed to get embeddings for {len(keys)} chunks: {e}")
+            return {}
+        mid = len(keys) // 2
+        first, second = await asyncio.gather(
+            embed_batch(keys[:mid], contents), embed_batch(keys[mid:], contents)
+        )
+        return {**first, **second}
 
 
-async def get_embedding(content: str) -> List[float]:
+async def get_embeddings(contents: List[str]) -> List[Optional[List[float]]]:
+    """
+    Embed all contents in length-sorted batches.
+    Embeddings found in the on-disk cache are not sent to the API and duplicate contents,
+    including ones being embedded by a concurrent call, are only sent once.
+    Contents that failed to embed get None.
+    """
+    keys = [embedding_cache_key(content) for content in contents]
+    embeddings: Dict[str, Optional[List[float]]] = dict(
+        load_cached_embeddings(list(set(keys)))
+    )
+
+    # Contents that a concurrent call is already embedding are awaited, not resent
+    in_flight = {
+        key: _pending_embeddings[key]
+        for key in keys
+        if key not in embeddings and key in _pending_embeddings
+    }
+    unique: Dict[str, str] = {}
+    for key, content in zip(keys, contents):
+        if key not in embeddings and key not in in_flight:
+            unique.setdefault(key, content)
+    misses = list(unique)
+    loop = asyncio.get_running_loop()
+    for key in misses:
+        _pending_embeddings[key] = loop.create_future()
+    print(
+        f"Embedding {len(misses)} of {len(contents)} chunks, the rest are cached or duplicates"
+    )
+
+    fetched: Dict[str, List[float]] = {}
     try:
-        response = await openai_client.embeddings.create(
-            model="text-embedding-3-small", input=content
+        batches = pack_embedding_batches(misses, unique)
+        results = await asyncio.gather(
+            *[embed_batch(batch, unique) for batch in batches]
         )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Failed to get embedding: {e}")
-        return [0] * 1536
+        for batch_embeddings in results:
+            fetched.update(batch_embeddings)
+        store_cached_embeddings(fetched)
+    finally:
+        # Stored to the on-disk cache first, so a later call finds each key in one of them
+        for key in misses:
+            _pending_embeddings.pop(key).set_result(fetched.get(key))
 
+    embeddings.update(fetched)
+    for key, future in in_flight.items():
+        embeddings[key] = await future
+    return [embeddings.get(key) for key in keys]
 
-async def process_chunks(name: str, file_path: str, content: str, idx: int):
-    summary = await get_summary(content)
-    embedding = await get_embedding(content)
+
+def process_chunk(
+    name: str,
+    file_path: str,
+    content: str,
+    idx: int,
+    summary: str,
+    embedding: List[float],
+) -> ProcessedChunk:
     metadata = {
         "source": "swiftui-atom-properties",
         "chunk_size": len(content),
@@ -80,62 +255,134 @@ async def process_chunks(name: str, file_path: str, content: str, idx: int):
     )
 
 
-async def insert_chunk(chunk: ProcessedChunk):
+def to_vector_literal(embedding: List[float]) -> str:
+    """
+    Format an embedding as a pgvector text literal.
+    The column is halfvec, so digits beyond 5 significant are dropped by Postgres anyway.
+    This is about half the size of the JSON float list and faster to build.
+    """
+    return "[" + ",".join(map("{:.5g}".format, embedding)) + "]"
+
+
+async def insert_chunks(chunks: List[ProcessedChunk]):
     try:
-        data = {
-            "chunk_idx": chunk.chunk_index,
-            "type_name": chunk.name,
-            "summary": chunk.summary,
-            "content": chunk.content,
-            "metadata": chunk.metadata,
-            "embedding": chunk.embedding,
-        }
-        result = supabase_client.table("code_pages").insert(data).execute()
-        print(f"Inserted chunk - {chunk.chunk_index}: {chunk.name}")
+        data = [
+            {
+                "chunk_idx": chunk.chunk_index,
+                "type_name": chunk.name,
+                "summary": chunk.summary,
+                "content": chunk.content,
+                "metadata": chunk.metadata,
+                "embedding": to_vector_literal(chunk.embedding),
+            }
+            for chunk in chunks
+        ]
+        # Upsert so re-ingesting a file doesn't reject the whole batch on the
+        # unique(type_name, chunk_idx) constraint.
+        # supabase-py is blocking, run it off the event loop.
+        result = await asyncio.to_thread(
+            supabase_client.table("code_pages")
+            .upsert(data, on_conflict="type_name,chunk_idx")
+            .execute
+        )
+        print(f"Upserted {len(chunks)} chunks")
         return result
     except Exception as e:
-        print(f"Failed to insert chunk: {e}")
+        print(f"Failed to insert chunks: {e}")
         return None
 
 
-async def chunk_code(content: str):
+def clean_chunk(chunk: str) -> Tuple[str, str, str]:
+    match = CHUNK_HEADER.match(chunk)
+    if not match:
+        print(f"Chunk formatting incorrect: {chunk}")
+        return "", "", chunk
+    file_path = Path(match["path"])
+    return file_path.stem, str(file_path), match["content"]
+
+
+def iter_file_chunks(path: Path) -> Iterator[Tuple[str, str, str]]:
     """
-    Just testing markdown splitting....
-    This chunking is unnesessary in this case since we are getting the contents of files. We should just get the contents of the files directly.
+    Read the markdown file incrementally and yield cleaned chunks as soon as their closing code fence is read.
+    Text before the first fence is skipped.
     """
-    chunker = RegexChunking([r"````\n\n", r"```\n\n"])
-    code_blocks = chunker.chunk(content)[1:]
+    buffer = ""
+    first = True
+    with path.open(encoding="utf-8") as f:
+        while block := f.read(READ_BLOCK_SIZE):
+            buffer += block
+            start = 0
+            for match in CHUNK_BOUNDARY.finditer(buffer):
+                if not first:
+                    yield clean_chunk(buffer[start : match.start()])
+                first = False
+                start = match.end()
+            buffer = buffer[start:]
+    if not first:
+        yield clean_chunk(buffer)
 
-    def clean_chunk(chunk) -> Tuple[str, str, str]:
-        try:
-            file_path_str, file_content = chunk.split("\n", 1)
-            file_path = Path(file_path_str.lstrip("## "))
-            file_name = file_path.stem
-            file_content = file_content.split("\n", 2)[2]
-            return file_name, str(file_path), file_content
-        except ValueError:
-            print(f"Chunk formatting incorrect: {chunk}")
-            return "", "", chunk
 
-    chunks = map(clean_chunk, code_blocks)
+async def ingest_batch(batch: List[Tuple[int, str, str, str]]):
+    contents = [content for _, _, _, content in batch]
+    # Summaries don't depend on the embeddings, so request both at once
+    embeddings, summaries = await asyncio.gather(
+        get_embeddings(contents),
+        asyncio.gather(
+            *[get_summary(content) for content in contents], return_exceptions=True
+        ),
+    )
 
-    tasks = [
-        process_chunks(name, file_path, chunk_content, idx)
-        for idx, (name, file_path, chunk_content) in enumerate(chunks)
-    ]
+    processed_chunks = []
+    for (idx, name, file_path, content), summary, embedding in zip(
+        batch, summaries, embeddings
+    ):
+        # Skip chunks that failed after retries rather than storing placeholders
+        if isinstance(summary, BaseException):
+            print(f"Failed to get content summary for chunk {idx}: {summary}")
+            continue
+        if embedding is None:
+            print(f"Skipping chunk {idx}: no embedding")
+            continue
+        processed_chunks.append(
+            process_chunk(name, file_path, content, idx, summary, embedding)
+        )
+
+    if processed_chunks:
+        await insert_chunks(processed_chunks)
+
+
+async def chunk_code(path: Path):
+    """
+    Stream chunks from the file through a queue to workers that embed, summarize and insert them in batches.
+    This chunking is unnesessary in this case since we are getting the contents of files. We should just get the contents of the files directly.
+    """
+    queue: asyncio.Queue[Optional[Tuple[int, str, str, str]]] = asyncio.Queue(
+        maxsize=128
+    )
 
-    processed_chunks = await asyncio.gather(*tasks)
+    async def produce():
+        for idx, (name, file_path, content) in enumerate(iter_file_chunks(path)):
+            await queue.put((idx, name, file_path, content))
+        for _ in range(INGEST_WORKERS):
+            await queue.put(None)
 
-    insert_tasks = [insert_chunk(chunk) for chunk in processed_chunks]
+    async def consume():
+        batch = []
+        while (item := await queue.get()) is not None:
+            batch.append(item)
+            if len(batch) == EMBEDDING_BATCH_SIZE:
+                await ingest_batch(batch)
+                batch = []
+        if batch:
+            await ingest_batch(batch)
 
-    await asyncio.gather(*insert_tasks)
+    await asyncio.gather(produce(), *[consume() for _ in range(INGEST_WORKERS)])
 
 
 async def main():
     load_dotenv()
     print(f"Loading Content...")
-    content = Path("input_data/result.markdown").read_text(encoding="utf-8")
-    await chunk_code(content)
+    await chunk_code(Path("input_data/result.markdown"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,39 @@
+import openai
+from tenacity import (RetryCallState, retry, retry_if_exception_type,
+                      stop_after_attempt, wait_exponential_jitter)
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+MAX_RETRY_AFTER = 60
+
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+
+def wait_retry_after(retry_state: RetryCallState) -> float:
+    """Wait as long as a 429's Retry-After header asks, otherwise back off exponentially."""
+    error = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(error, openai.RateLimitError):
+        headers = error.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return min(float(headers["retry-after-ms"]) / 1000, MAX_RETRY_AFTER)
+            if "retry-after" in headers:
+                return min(float(headers["retry-after"]), MAX_RETRY_AFTER)
+        except ValueError:
+            # Retry-After can also be an HTTP date, fall back to backoff
+            pass
+    return _backoff(retry_state)
+
+
+# Retry transient OpenAI failures (rate limits, timeouts, 5xx) with backoff.
+# The clients are created with max_retries=0 so this is the only retry layer.
+openai_retry = retry(
+    wait=wait_retry_after,
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True,
+)
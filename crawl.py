@@ -1,6 +1,5 @@
 import asyncio
-from typing import List
-from xml.etree import ElementTree
+from typing import List, Optional
 
 from crawl4ai import (AsyncWebCrawler, BrowserConfig, CacheMode,
                       CrawlerMonitor, CrawlerRunConfig,
@@ -9,10 +8,33 @@ from crawl4ai import (AsyncWebCrawler, BrowserConfig, CacheMode,
 from crawl4ai.async_dispatcher import MemoryAdaptiveDispatcher
 from crawl4ai.models import CrawlResult
 from crawl4ai.utils import requests
+from lxml import etree
+
+
+_crawler: Optional[AsyncWebCrawler] = None
+_crawler_lock = asyncio.Lock()
+
+
+async def get_crawler() -> AsyncWebCrawler:
+    """Start the shared browser on first use and reuse it for later crawls."""
+    global _crawler
+    async with _crawler_lock:
+        if _crawler is None:
+            crawler = AsyncWebCrawler(config=BrowserConfig(headless=True))
+            await crawler.start()
+            _crawler = crawler
+        return _crawler
+
+
+async def close_crawler():
+    global _crawler
+    async with _crawler_lock:
+        if _crawler is not None:
+            await _crawler.close()
+            _crawler = None
 
 
 async def crawl(urls: List[str]):
-    config = BrowserConfig(headless=False)
     prune_filter = PruningContentFilter(threshold_type="dynamic")
     md_generator = DefaultMarkdownGenerator(content_filter=prune_filter)
     run_config = CrawlerRunConfig(
@@ -25,23 +47,32 @@ async def crawl(urls: List[str]):
         monitor=CrawlerMonitor(max_visible_rows=50, display_mode=DisplayMode.DETAILED),
     )
 
-    async with AsyncWebCrawler(config=config) as crawler:
-        result = await crawler.arun_many(urls, config=run_config, dispatcher=dispatcher)
-        return result
+    crawler = await get_crawler()
+    result = await crawler.arun_many(urls, config=run_config, dispatcher=dispatcher)
+    return result
 
 
 def get_sitemap_urls() -> List[str]:
     sitemap_url = ""
 
     try:
-        response = requests.get(sitemap_url)
-        response.raise_for_status()
-
-        root = ElementTree.fromstring(response.content)
-
-        namespace = {"ns": "http://www.sitemaps.org/schemas/sitemap/0.9"}
-        urls = [loc.text for loc in root.findall(".//ns:loc", namespace) if loc.text]
-        return urls
+        with requests.get(sitemap_url, stream=True) as response:
+            response.raise_for_status()
+            # Let urllib3 undo any gzip/deflate encoding while lxml reads the stream
+            response.raw.decode_content = True
+
+            urls = []
+            for _, loc in etree.iterparse(
+                response.raw, tag="{http://www.sitemaps.org/schemas/sitemap/0.9}loc"
+            ):
+                if loc.text:
+                    urls.append(loc.text)
+                loc.clear()
+                # Drop the already read <url> entries so the tree doesn't grow
+                entry = loc.getparent()
+                while entry.getprevious() is not None:
+                    del entry.getparent()[0]
+            return urls
 
     except Exception as e:
         print(f"Error fetching urls: {e}")
@@ -57,12 +88,15 @@ async def main():
     if not urls:
         print("Failed to fetch URLs")
         return
-    results = await crawl(urls)
-    for result in results:
-        if result.success:
-            await process_result(result.url, result.markdown_v2.raw_markdown)
-        else:
-            print(f"Failed to Crawl: {result.url}")
+    try:
+        results = await crawl(urls)
+        for result in results:
+            if result.success:
+                await process_result(result.url, result.markdown_v2.raw_markdown)
+            else:
+                print(f"Failed to Crawl: {result.url}")
+    finally:
+        await close_crawler()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
 import asyncio
 import os
-from typing import Literal, TypedDict, cast
+from typing import List, Literal, Tuple, TypedDict, cast
 
 import streamlit as st
 from dotenv import load_dotenv
@@ -8,12 +8,13 @@ from openai import AsyncOpenAI
 from pydantic_ai.messages import (ModelRequest, ModelResponse, TextPart,
                                   UserPromptPart)
 
-from atom.agent import Dependencies, library_agent
+from atom.agent import (Dependencies, cache_response, get_cached_response,
+                        get_embedding, library_agent)
 from supabase import Client
 
 load_dotenv()
 
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 supabase: Client = Client(
     cast(str, os.getenv("SUPABASE_URL")), cast(str, os.getenv("SUPABASE_SERVICE_KEY"))
 )
@@ -27,22 +28,52 @@ class ChatMessage(TypedDict):
     content: str
 
 
-def display_message(part):
-    if part.part_kind == "system-prompt":
-        with st.chat_message("system"):
-            st.markdown(f"**System**, {part.content}")
+def rendered_parts(msg) -> List[Tuple[str, str]]:
+    """The (role, markdown) pairs shown in the chat for a message"""
+    if not isinstance(msg, (ModelRequest, ModelResponse)):
+        return []
 
-    elif part.part_kind == "user-prompt":
-        with st.chat_message("user"):
-            st.markdown(part.content)
+    rendered = []
+    for part in msg.parts:
+        if part.part_kind == "system-prompt":
+            rendered.append(("system", f"**System**, {part.content}"))
+        elif part.part_kind == "user-prompt":
+            rendered.append(("user", part.content))
+        elif part.part_kind == "text":
+            rendered.append(("assistant", part.content))
+    return rendered
 
-    elif part.part_kind == "text":
-        with st.chat_message("assistant"):
-            st.markdown(part.content)
+
+def add_messages(*messages):
+    # Extract the displayable parts once, reruns just redraw rendered_history
+    st.session_state.messages.extend(messages)
+    for msg in messages:
+        st.session_state.rendered_history.extend(rendered_parts(msg))
+
+
+def display_message(role: str, content: str):
+    with st.chat_message(role):
+        st.markdown(content)
 
 
 async def run_agent_with_streaming(user_input: str):
 
+    # The cache is keyed on the question alone, so it's only valid without prior context
+    first_turn = len(st.session_state.messages) == 1
+    query_embedding = None
+    cached_response = None
+    if first_turn:
+        try:
+            query_embedding = await get_embedding(user_input, openai_client)
+            cached_response = await get_cached_response(supabase, query_embedding)
+        except Exception as e:
+            print(f"Skipping semantic cache: {e}")
+
+    if cached_response:
+        st.empty().markdown(cached_response)
+        add_messages(ModelResponse(parts=[TextPart(content=cached_response)]))
+        return
+
     deps = Dependencies(supabase=supabase, openai_client=openai_client)
 
     async with library_agent.run_stream(
@@ -66,12 +97,13 @@ async def run_agent_with_streaming(user_input: str):
             )
         ]
 
-        st.session_state.messages.extend(filtered_messages)
-
-        st.session_state.messages.append(
-            ModelResponse(parts=[TextPart(content=partial_text)])
+        add_messages(
+            *filtered_messages, ModelResponse(parts=[TextPart(content=partial_text)])
         )
 
+    if first_turn:
+        await cache_response(supabase, query_embedding, partial_text)
+
 
 async def main():
     st.title("SwiftUI Atom Properties: Agent")
@@ -79,18 +111,15 @@ async def main():
 
     if "messages" not in st.session_state:
         st.session_state.messages = []
+        st.session_state.rendered_history = []
 
-    for msg in st.session_state.messages:
-        if isinstance(msg, ModelRequest) or isinstance(msg, ModelResponse):
-            for part in msg.parts:
-                display_message(part)
+    for role, content in st.session_state.rendered_history:
+        display_message(role, content)
 
     user_input = st.chat_input("Ask you question here")
 
     if user_input:
-        st.session_state.messages.append(
-            ModelRequest(parts=[UserPromptPart(content=user_input)])
-        )
+        add_messages(ModelRequest(parts=[UserPromptPart(content=user_input)]))
 
         with st.chat_message("user"):
             st.markdown(user_input)
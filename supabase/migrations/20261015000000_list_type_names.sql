@@ -0,0 +1,10 @@
+-- Distinct, sorted type names for a source, used by the get_type_names agent tool
+create or replace function list_type_names(source text)
+returns table (type_name text)
+language sql stable
+as $$
+  select distinct code_pages.type_name
+  from code_pages
+  where code_pages.metadata->>'source' = list_type_names.source
+  order by code_pages.type_name;
+$$;
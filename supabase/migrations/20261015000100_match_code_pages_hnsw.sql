@@ -0,0 +1,42 @@
+-- Replace the ivfflat index from atom/code_pages.sql, it was built on an empty
+-- table so its lists give poor recall and the planner could still pick it.
+drop index if exists code_pages_embedding_idx;
+
+-- Approximate nearest neighbour index for match_code_pages.
+-- The opclass must match the <=> (cosine distance) operator used below.
+create index if not exists code_pages_embedding_hnsw_idx
+  on code_pages using hnsw (embedding vector_cosine_ops)
+  with (m = 16, ef_construction = 64);
+
+-- The return columns changed (no id), which create or replace can't do
+drop function if exists match_code_pages(vector, int, jsonb);
+
+-- Ordering by the raw distance with a limit lets the planner use the HNSW index
+create function match_code_pages(
+  query_embedding vector(1536),
+  match_count int default 5,
+  filter jsonb default '{}'::jsonb
+)
+returns table (
+  chunk_idx int,
+  type_name varchar,
+  summary varchar,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language sql stable
+set hnsw.ef_search = 40
+as $$
+  select
+    code_pages.chunk_idx,
+    code_pages.type_name,
+    code_pages.summary,
+    code_pages.content,
+    code_pages.metadata,
+    1 - (code_pages.embedding <=> query_embedding) as similarity
+  from code_pages
+  where code_pages.metadata @> filter
+  order by code_pages.embedding <=> query_embedding
+  limit match_count;
+$$;
@@ -0,0 +1,40 @@
+-- Agent responses keyed by the embedding of the question that produced them
+create table if not exists semantic_cache (
+  id bigserial primary key,
+  query_embedding vector(1536) not null,
+  response text not null,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists semantic_cache_query_embedding_hnsw_idx
+  on semantic_cache using hnsw (query_embedding vector_cosine_ops);
+
+-- cache_response deletes rows older than the TTL by created_at
+create index if not exists semantic_cache_created_at_idx
+  on semantic_cache (created_at);
+
+-- Closest cached response within max_distance that is younger than max_age
+create or replace function match_semantic_cache(
+  query_embedding vector(1536),
+  max_distance float default 0.08,
+  max_age interval default '1 hour'
+)
+returns table (response text, distance float)
+language sql stable
+as $$
+  select *
+  from (
+    select
+      semantic_cache.response,
+      semantic_cache.query_embedding <=> match_semantic_cache.query_embedding as distance
+    from semantic_cache
+    where semantic_cache.created_at > now() - max_age
+    order by semantic_cache.query_embedding <=> match_semantic_cache.query_embedding
+    limit 1
+  ) closest
+  where closest.distance < max_distance;
+$$;
+
+-- Cached responses are served to every user, so only the service role may write.
+-- No policies are added, anon and authenticated roles get no access.
+alter table semantic_cache enable row level security;
@@ -0,0 +1,17 @@
+-- Indexable copy of metadata->>'source' so source filters don't extract JSON per row
+alter table code_pages
+  add column if not exists source_tag text
+  generated always as (metadata->>'source') stored;
+
+create index if not exists code_pages_source_tag_type_name_idx
+  on code_pages (source_tag, type_name);
+
+create or replace function list_type_names(source text)
+returns table (type_name text)
+language sql stable
+as $$
+  select distinct code_pages.type_name
+  from code_pages
+  where code_pages.source_tag = list_type_names.source
+  order by code_pages.type_name;
+$$;
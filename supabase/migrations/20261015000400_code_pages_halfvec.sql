@@ -0,0 +1,44 @@
+-- Store code_pages embeddings as half precision to halve index and scan memory.
+-- Clients keep sending float vectors, pgvector casts them on insert.
+-- Both indexes use vector_cosine_ops, which can't index halfvec, so the
+-- ALTER would fail trying to rebuild them
+drop index if exists code_pages_embedding_idx;
+drop index if exists code_pages_embedding_hnsw_idx;
+
+alter table code_pages
+  alter column embedding type halfvec(1536)
+  using embedding::halfvec(1536);
+
+create index code_pages_embedding_hnsw_idx
+  on code_pages using hnsw (embedding halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64);
+
+-- Cast the query to halfvec so the distance matches the index opclass
+create or replace function match_code_pages(
+  query_embedding vector(1536),
+  match_count int default 5,
+  filter jsonb default '{}'::jsonb
+)
+returns table (
+  chunk_idx int,
+  type_name varchar,
+  summary varchar,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language sql stable
+set hnsw.ef_search = 40
+as $$
+  select
+    code_pages.chunk_idx,
+    code_pages.type_name,
+    code_pages.summary,
+    code_pages.content,
+    code_pages.metadata,
+    1 - (code_pages.embedding <=> query_embedding::halfvec(1536)) as similarity
+  from code_pages
+  where code_pages.metadata @> filter
+  order by code_pages.embedding <=> query_embedding::halfvec(1536)
+  limit match_count;
+$$;